@@ -0,0 +1,56 @@
+"""Compare `-O` with `pickletools.optimize` on time and output size.
+
+Usage: python benchmarks/optimizer.py [repeat]
+"""
+import os
+import pickletools
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pickora import Compiler  # noqa: E402
+
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "samples")
+
+
+def generated(count=6000, names=500):
+    # many reassigned names, read back a few lines later
+    lines = [f"v{i} = {i}" for i in range(names)]
+    for i in range(count):
+        lines.append(f"v{i % names} = (v{(i - 1) % names}, {i}, 'abc')")
+    return "\n".join(lines)
+
+
+def programs():
+    for name in ("general.py", "picklection.py", "test_calculation.py"):
+        with open(os.path.join(SAMPLES, name)) as f:
+            yield name, f.read()
+    yield "generated", generated()
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'program':20} {'protocol':>8} {'pickletools':>20} {'pickora -O':>20}")
+    for name, source in programs():
+        for protocol in (2, 4, 5):
+            plain = Compiler(protocol=protocol, extended=True)
+            optimized = Compiler(protocol=protocol, extended=True, optimize=True)
+
+            # both include the compilation, -O doesn't work without it
+            def baseline():
+                return pickletools.optimize(plain.compile(source))
+
+            def ours():
+                return optimized.compile(source)
+
+            results = []
+            for func in (baseline, ours):
+                seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+                results.append(f"{len(func()):>8} B {seconds * 1000:>7.2f} ms")
+            print(f"{name:20} {protocol:>8} {results[0]:>20} {results[1]:>20}")
+
+
+if __name__ == "__main__":
+    main()
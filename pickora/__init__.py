@@ -2,14 +2,120 @@ import argparse
 import pickle
 import sys
 import base64
-from .compiler import Compiler
+from .compiler import Compiler, VECTORIZE_THRESHOLD
+from .linker import Unit, link
+from .folding import PureFunctions
+from .session import Session
+from .pool import CompilerPool
 from .helper import PickoraError
 import ast
 
 
+def add_output_arguments(parser):
+    parser.add_argument("-o", "--output", help="output file")
+    parser.add_argument("-d", "--disassemble",
+                        action="store_true", help="disassemble pickle bytecode")
+    parser.add_argument("-r", "--run", action="store_true",
+                        help="run (load) pickle bytecode immediately")
+    parser.add_argument("-f", "--format",
+                        choices=["repr", "raw", "hex", "base64", "none"], default="repr", help="output format, none means no output")
+
+
+def format_code(code, format):
+    if format == "repr":
+        return repr(code)
+    elif format == "raw":
+        return code.decode('latin1')
+    elif format == "hex":
+        return code.hex()
+    elif format == "base64":
+        return base64.b64encode(code).decode()
+    elif format == "none":
+        return None
+
+
+def output(args, code):
+    if args.disassemble:
+        import pickletools
+        try:
+            pickletools.dis(code)
+        except Exception as e:
+            print("[x] Disassemble error:", e, file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(code)
+    else:
+        formatted = format_code(code, args.format)
+        if formatted is not None:
+            print(formatted, end="" if args.format == "raw" else "\n")
+
+    if args.run:
+        print("[*] Running pickle bytecode...")
+        ret = pickle.loads(code)
+        print("[*] Return value:", repr(ret))
+
+
+def link_main(argv):
+    description = "Link units compiled with `pickora --unit` into one pickle bytecode."
+    parser = argparse.ArgumentParser(prog="pickora link", description=description)
+    parser.add_argument("units", nargs="+", help="unit files, in order")
+    add_output_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    try:
+        units = []
+        for filename in args.units:
+            with open(filename, "rb") as f:
+                units.append(Unit.load(f))
+        code = link(units)
+    except PickoraError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    output(args, code)
+
+
+def repl(args, session):
+    import codeop
+    print("Pickora interactive mode, the pickle is terminated with EOF (Ctrl-D)")
+    while True:
+        try:
+            source = input(">>> ")
+            if not source.strip():
+                continue
+            # read the rest of multi-line statements
+            while codeop.compile_command(source, symbol="exec") is None:
+                source += "\n" + input("... ")
+        except EOFError:
+            print()
+            break
+        except SyntaxError as e:
+            print(f"{e.__class__.__name__}: {e}", file=sys.stderr)
+            continue
+
+        try:
+            code = session.feed(source, "<stdin>")
+        except PickoraError as e:
+            print(e, file=sys.stderr)
+            continue
+
+        print(f"[+] {len(code)} bytes, {len(session)} bytes in total")
+        if args.format not in ("raw", "none"):
+            print(format_code(code, args.format))
+
+    session.finish()
+    return session.getvalue()
+
+
 def main():
+    if sys.argv[1:2] == ["link"]:
+        return link_main(sys.argv[2:])
+
     description = "A toy compiler that can convert Python scripts into pickle bytecode."
-    epilog = "Basic usage: `pickora samples/hello.py` or `pickora --code 'print(\"Hello, world!\")' --extended`"
+    epilog = "Basic usage: `pickora samples/hello.py` or `pickora --code 'print(\"Hello, world!\")' --extended`, " \
+        "link units with `pickora link prelude.pku payload.pku -o output.pkl`"
     parser = argparse.ArgumentParser(description=description, epilog=epilog)
     parser.add_argument("source", nargs="?", help="source code file")
 
@@ -19,21 +125,30 @@ def main():
     parser.add_argument("-e", "--extended", action="store_true",
                         help="enable extended syntax (trigger find_class)")
     parser.add_argument("-O", "--optimize", action="store_true",
-                        help="optimize pickle bytecode (with pickletools.optimize)")
+                        help="optimize pickle bytecode (peephole optimizer)")
+    parser.add_argument("-V", "--vectorize", type=int, default=VECTORIZE_THRESHOLD, metavar="N",
+                        help="pack numeric literals with at least N items into bytes (extended syntax, 0 to disable)")
+    parser.add_argument("--no-fold", action="store_true",
+                        help="don't evaluate pure function calls at compile time")
+    parser.add_argument("-i", "--interactive", action="store_true",
+                        help="compile statements as they are typed")
+    parser.add_argument("-u", "--unit", action="store_true",
+                        help="compile to a relocatable unit for `pickora link`")
 
-    parser.add_argument("-o", "--output", help="output file")
-    parser.add_argument("-d", "--disassemble",
-                        action="store_true", help="disassemble pickle bytecode")
-    parser.add_argument("-r", "--run", action="store_true",
-                        help="run (load) pickle bytecode immediately")
-    parser.add_argument("-f", "--format",
-                        choices=["repr", "raw", "hex", "base64", "none"], default="repr", help="output format, none means no output")
+    add_output_arguments(parser)
 
     args = parser.parse_args()
 
     if args.source and args.code:
         parser.error("You can only specify one of source code file or string.")
 
+    if args.interactive:
+        if args.source or args.code or args.unit or args.optimize:
+            parser.error("Interactive mode can't be used with source code, units or optimization.")
+        session = Session(protocol=args.protocol, extended=args.extended, vectorize=args.vectorize,
+                          pure_functions=PureFunctions(()) if args.no_fold else None)
+        return output(args, repl(args, session))
+
     if args.source:
         with open(args.source, "r") as f:
             source = f.read()
@@ -42,40 +157,20 @@ def main():
     else:
         parser.error("You must specify source code file or string.")
 
-    compiler = Compiler(protocol=args.protocol,
-                        optimize=args.optimize, extended=args.extended)
+    if args.unit and (args.disassemble or args.run):
+        parser.error("Units can't be disassembled or run before linking.")
+
+    compiler = Compiler(protocol=args.protocol, optimize=args.optimize,
+                        extended=args.extended, vectorize=args.vectorize,
+                        pure_functions=PureFunctions(()) if args.no_fold else None)
 
     try:
-        code = compiler.compile(source, args.source)
+        if args.unit:
+            code = compiler.compile_unit(source, args.source).dumps()
+        else:
+            code = compiler.compile(source, args.source)
     except PickoraError as e:
         print(e, file=sys.stderr)
         sys.exit(1)
 
-    if args.disassemble:
-        import pickletools
-        try:
-            pickletools.dis(code)
-        except Exception as e:
-            print("[x] Disassemble error:", e, file=sys.stderr)
-
-    if args.output:
-        with open(args.output, "wb") as f:
-            f.write(code)
-    else:
-        if args.format == "repr":
-            print(repr(code))
-        elif args.format == "raw":
-            print(code.decode('latin1'), end="")
-        elif args.format == "hex":
-            print(code.hex())
-        elif args.format == "base64":
-            print(base64.b64encode(code).decode())
-        elif args.format == "none":
-            pass
-
-    if args.run:
-        print("[*] Running pickle bytecode...")
-        ret = pickle.loads(code)
-        print("[*] Return value:", repr(ret))
-
-
+    output(args, code)
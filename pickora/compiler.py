@@ -1,5 +1,4 @@
 import pickle
-import pickletools
 import ast
 import io
 import sys
@@ -7,17 +6,43 @@ from struct import pack
 import types
 from typing import Any
 
-from .helper import PickoraError, PickoraNameError, PickoraNotImplementedError, op_to_method, extended, is_builtins, macro
+from .helper import PickoraError, PickoraNameError, PickoraNotImplementedError, op_to_method, extended, is_builtins, macro, number_value, pack_numbers
+from .optimizer import Optimizer, op_put, op_global
+from .linker import Unit
+from .folding import PureFunctions, NOT_CONSTANT, literal_size, is_stable
+
+# containers with at least this many numbers are packed with struct
+VECTORIZE_THRESHOLD = 128
 
 
 class NodeVisitor(ast.NodeVisitor):
-    def __init__(self, pickler, extended=False):
+    def __init__(self, pickler, extended=False, vectorize=VECTORIZE_THRESHOLD, pure_functions=None):
         self.pickler = pickler
         self.proto = pickler.proto
         self.memo = {}
 
+        # compile time evaluation
+        self.pure_functions = PureFunctions() if pure_functions is None else pure_functions
+        self.symbols = {}    # name -> (module, name) it was imported from
+        self.constants = {}  # name -> immutable value it is bound to
+        self.sizes = {}      # id of a bound value -> (value, its size)
+        self.folded = {}     # node -> its value, or NOT_CONSTANT
+        self.patched = False  # whether the program may have patched a module
+
         self.extended = extended
+        self.vectorize = vectorize
+        self.externs = None  # names left to the linker when compiling a unit
+
+        self.current_node = None
 
+    def reset(self):
+        self.memo.clear()
+        self.symbols.clear()
+        self.constants.clear()
+        self.sizes.clear()
+        self.folded.clear()
+        self.patched = False
+        self.externs = None
         self.current_node = None
 
     def is_macro(self, macro_name):
@@ -71,13 +96,16 @@ class NodeVisitor(ast.NodeVisitor):
         self.save(node.value)
 
     def visit_List(self, node):
-        self.pickler.save_list(node.elts)
+        if not self.save_packed(node.elts, 'list'):
+            self.pickler.save_list(node.elts)
 
     def visit_Tuple(self, node):
-        self.pickler.save_tuple(node.elts)
+        if not self.save_packed(node.elts, 'tuple'):
+            self.pickler.save_tuple(node.elts)
 
     def visit_Set(self, node):
-        self.pickler.save_set(node.elts)
+        if not self.save_packed(node.elts, 'set'):
+            self.pickler.save_set(node.elts)
 
     def visit_Dict(self, node):
         self.pickler.save_dict({
@@ -87,6 +115,10 @@ class NodeVisitor(ast.NodeVisitor):
     def visit_Name(self, node):
         if node.id in self.memo:
             self.get(node.id)
+        elif self.externs is not None and not (self.extended and is_builtins(name=node.id)):
+            # resolved by the linker from the previous units
+            self.externs[node.id] = None
+            self.get(node.id)
         elif is_builtins(name=node.id):
             if not self.extended:
                 raise PickoraError(
@@ -101,6 +133,7 @@ class NodeVisitor(ast.NodeVisitor):
     def visit_NamedExpr(self, node):
         self.visit(node.value)
         self.put(node.target.id)
+        self.bind(node.target.id, node.value)
 
     def visit_Assign(self, node):
         targets, value = node.targets, node.value
@@ -108,13 +141,17 @@ class NodeVisitor(ast.NodeVisitor):
             if isinstance(target, ast.Name):
                 self.visit(value)
                 self.put(target.id)
+                self.bind(target.id, value)
             elif isinstance(target, ast.Subscript):
+                if isinstance(target.value, ast.Attribute) and target.value.attr == "__dict__":
+                    self.patched = True
                 self.visit(target.value)
                 self.visit(target.slice)
                 self.visit(value)
                 self.write(pickle.SETITEM)
             elif isinstance(target, ast.Attribute):
                 # BUILD({}, {"attr": 1337})
+                self.patched = True
                 self.visit(target.value)
                 self.write(pickle.EMPTY_DICT)
                 self.pickler.save_dict({target.attr: value})
@@ -141,8 +178,11 @@ class NodeVisitor(ast.NodeVisitor):
 
     def visit_Call(self, node):
         if isinstance(node.func, ast.Name) and self.is_macro(node.func.id):
+            self.patched |= node.func.id == "BUILD"
             getattr(self, node.func.id)(*node.args)
             return
+        if self.resolve(node.func) in (("builtins", "setattr"), ("builtins", "delattr")):
+            self.patched = True
 
         self.visit(node.func)
         self.pickler.save_tuple(node.args)
@@ -152,10 +192,9 @@ class NodeVisitor(ast.NodeVisitor):
     def visit_ImportFrom(self, node):
         for alias in node.names:
             self.find_class(node.module, alias.name)
-            if alias.asname is not None:
-                self.put(alias.asname)
-            else:
-                self.put(alias.name)
+            name = alias.asname if alias.asname is not None else alias.name
+            self.put(name)
+            self.symbols[name] = (node.module, alias.name)
 
     def visit_Module(self, node):
         for stmt in node.body:
@@ -172,10 +211,9 @@ class NodeVisitor(ast.NodeVisitor):
     def visit_Import(self, node):
         for alias in node.names:
             self.call("importlib", "import_module", alias.name)
-            if alias.asname is not None:
-                self.put(alias.asname)
-            else:
-                self.put(alias.name)
+            name = alias.asname if alias.asname is not None else alias.name
+            self.put(name)
+            self.symbols[name] = (alias.name, None)
 
     @extended
     def visit_AugAssign(self, node):
@@ -252,7 +290,10 @@ class NodeVisitor(ast.NodeVisitor):
 
     def find_class(self, module, name):
         if self.memo.get((module, name), None) is None:
-            if self.proto >= 4:
+            if self.pickler.optimizer is not None:
+                # let the linker merge the same globals across units
+                self.pickler.optimizer.write_global(module, name)
+            elif self.proto >= 4:
                 self.save(module)
                 self.save(name)
                 self.write(pickle.STACK_GLOBAL)
@@ -266,6 +307,120 @@ class NodeVisitor(ast.NodeVisitor):
         else:
             self.get((module, name))
 
+    def save_packed(self, elts, factory):
+        # list(struct.unpack('<1000q', b'...')) instead of one opcode per number,
+        # from protocol 3 (before, bytes are saved through a latin-1 str)
+        if not self.extended or not self.vectorize or len(elts) < self.vectorize or \
+                self.proto < 3:
+            return False
+
+        values = []
+        for elt in elts:
+            value = number_value(elt)
+            if value is None:
+                return False
+            values.append(value)
+
+        packed = pack_numbers(values)
+        if packed is None:
+            return False
+
+        # only when it is smaller, e.g. a single large int makes every item 8 bytes
+        plain = len(pickle.dumps({'list': list, 'tuple': tuple, 'set': set}[factory](values), self.proto))
+        size = len(pickle.dumps(packed, self.proto)) + \
+            len(op_global("builtins", factory, self.proto)) + \
+            len(op_global("struct", "unpack", self.proto))
+        if size >= plain:
+            return False
+
+        self.find_class("builtins", factory)
+        self.call("struct", "unpack", *packed)
+        self.write(pickle.TUPLE1)
+        self.write(pickle.REDUCE)
+        return True
+
+    def resolve(self, node):
+        # the (module, name) a name or an attribute refers to, if known
+        if isinstance(node, ast.Name):
+            if node.id in self.symbols:
+                return self.symbols[node.id]
+            if node.id not in self.memo and self.extended and is_builtins(name=node.id):
+                return ("builtins", node.id)
+        elif isinstance(node, ast.Attribute):
+            base = self.resolve(node.value)
+            if base is not None:
+                module, name = base
+                return (module, node.attr if name is None else f"{name}.{node.attr}")
+        return None
+
+    def constant(self, node):
+        if isinstance(node, ast.Constant):
+            if literal_size(node.value, self.pure_functions.max_size) is None:
+                return NOT_CONSTANT
+            return node.value
+        if isinstance(node, ast.Name) and node.id in self.constants:
+            return self.constants[node.id]
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            values = []
+            for elt in node.elts:
+                values.append(self.constant(elt))
+                if values[-1] is NOT_CONSTANT:
+                    return NOT_CONSTANT
+            if isinstance(node, ast.Set) and not all(map(is_stable, values)):
+                # the order of str or bytes items changes with PYTHONHASHSEED
+                return NOT_CONSTANT
+            return {ast.Tuple: tuple, ast.List: list, ast.Set: set}[type(node)](values)
+        if isinstance(node, (ast.Name, ast.Attribute, ast.BinOp, ast.UnaryOp, ast.Call)):
+            if node not in self.folded:
+                self.folded[node] = self.evaluate(node)
+            return self.folded[node]
+        return NOT_CONSTANT
+
+    def evaluate(self, node):
+        if self.patched:
+            # the modules may not hold what they hold in the compiler anymore
+            return NOT_CONSTANT
+
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            key = self.resolve(node)
+            return NOT_CONSTANT if key is None else self.pure_functions.value(key)
+
+        if isinstance(node, ast.BinOp):
+            key, args = ("operator", op_to_method[type(node.op)]), (node.left, node.right)
+        elif isinstance(node, ast.UnaryOp):
+            key, args = ("operator", op_to_method[type(node.op)]), (node.operand,)
+        elif node.keywords or (isinstance(node.func, ast.Name) and self.is_macro(node.func.id)):
+            return NOT_CONSTANT
+        else:
+            key, args = self.resolve(node.func), node.args
+            if key is None and isinstance(node.func, ast.Attribute):
+                # methods of constants, e.g. "{}".format(1)
+                obj = self.constant(node.func.value)
+                if type(obj) in (str, bytes):
+                    key = ("builtins", f"{type(obj).__name__}.{node.func.attr}")
+                    args = (ast.Constant(value=obj), *args)
+
+        if key not in self.pure_functions:
+            return NOT_CONSTANT
+        values = []
+        for arg in args:
+            values.append(self.constant(arg))
+            if values[-1] is NOT_CONSTANT:
+                return NOT_CONSTANT
+        return self.pure_functions.evaluate(key, values, self.sizes)
+
+    def bind(self, name, node):
+        # only with the extended syntax, like folding itself
+        if not self.extended:
+            return
+        value = self.constant(node)
+        if value is NOT_CONSTANT:
+            return
+        size = literal_size(value, self.pure_functions.max_size, immutable=True, known=self.sizes)
+        if size is not None:
+            self.constants[name] = value
+            self.sizes[id(value)] = (value, size)
+
     def call(self, module, name, *args):
         self.find_class(module, name)
         self.pickler.save_tuple(args)
@@ -274,34 +429,33 @@ class NodeVisitor(ast.NodeVisitor):
     # memo related functions
 
     def put(self, name, pop=False):
-        def op_put(idx):
-            if self.pickler.bin:
-                if idx < 256:
-                    return pickle.BINPUT + pack("<B", idx)
-                else:
-                    return pickle.LONG_BINPUT + pack("<I", idx)
-            else:
-                return pickle.PUT + repr(idx).encode("ascii") + b'\n'
+        optimizer = self.pickler.optimizer
 
-        def op_memoize():
-            return pickle.MEMOIZE
+        # forget what the name was bound to
+        self.symbols.pop(name, None)
+        self.sizes.pop(id(self.constants.pop(name, None)), None)
+
+        # the optimizer numbers the memo by itself
+        if optimizer is not None:
+            self.memo.setdefault(name, len(self.memo))
+            optimizer.put(name)
 
         # assign to an existing name
-        if name in self.memo:
+        elif name in self.memo:
             idx = self.memo[name]
-            self.write(op_put(idx))
+            self.write(op_put(idx, self.pickler.bin))
 
         # assign to a new name
         elif self.proto >= 4:
             self.memo[name] = len(self.memo)
-            self.write(op_memoize())
+            self.write(pickle.MEMOIZE)
         else:
             idx = len(self.memo)
             self.memo[name] = idx
-            self.write(op_put(idx))
+            self.write(op_put(idx, self.pickler.bin))
 
         if pop:
-            self.write(pickle.POP)
+            self.pop()
 
     def put_temp(self):
         # generate a temporary name
@@ -310,8 +464,17 @@ class NodeVisitor(ast.NodeVisitor):
         return name
 
     def get(self, name):
-        idx = self.memo[name]
-        self.write(self.pickler.get(idx))
+        if self.pickler.optimizer is not None:
+            self.pickler.optimizer.get(name)
+        else:
+            idx = self.memo[name]
+            self.write(self.pickler.get(idx))
+
+    def pop(self):
+        if self.pickler.optimizer is not None:
+            self.pickler.optimizer.pop()
+        else:
+            self.write(pickle.POP)
 
     def visit(self, node):
         self.current_node = node
@@ -321,6 +484,12 @@ class NodeVisitor(ast.NodeVisitor):
                 f"Pickora does not support {type(node).__name__} yet"
             )
 
+        # only with the extended syntax, so what compiles never depends on the folded values
+        if self.extended and isinstance(node, (ast.Attribute, ast.BinOp, ast.UnaryOp, ast.Call)):
+            value = self.constant(node)
+            if value is not NOT_CONSTANT:
+                return self.save(value)
+
         return super().visit(node)
 
     def save(self, obj):
@@ -332,25 +501,43 @@ class NodeVisitor(ast.NodeVisitor):
 
 # compile the source code into bytecode
 class Compiler(pickle._Pickler):
-    def __init__(self, protocol=pickle.DEFAULT_PROTOCOL, optimize=False, extended=False):
+    def __init__(self, protocol=pickle.DEFAULT_PROTOCOL, optimize=False, extended=False,
+                 vectorize=VECTORIZE_THRESHOLD, pure_functions=None):
         self.opcodes = io.BytesIO()
         self.optimize = optimize
 
         super().__init__(self.opcodes, protocol)
-        self.codegen = NodeVisitor(self, extended=extended)
+        self.optimizer = None
+        if optimize:
+            self.record()
+        self.codegen = NodeVisitor(self, extended=extended, vectorize=vectorize,
+                                   pure_functions=pure_functions)
         self.fast = True  # disable default memoization
 
-    def compile(self, source, filename="<string>"):
-        if not filename:
-            filename = "<string>"
+    def reset(self):
+        # forget the previous compilation, keeping the options
+        self.opcodes = io.BytesIO()
+        self.framer = pickle._Framer(self.opcodes.write)
+        self.write = self.framer.write
+        self._write_large_bytes = self.framer.write_large_bytes
+        self.optimizer = None
+        if self.optimize:
+            self.record()
+        self.codegen.reset()
 
-        if self.proto >= 2:
-            self.write(pickle.PROTO + pack("<B", self.proto))
-        if self.proto >= 4:
-            self.framer.start_framing()
+    def record(self):
+        # keep the opcodes in an optimizer instead of writing them out
+        self.optimizer = Optimizer(self.proto)
+        self.write = self.optimizer.write
+        self._write_large_bytes = self.optimizer.write_large_bytes
+
+    def generate(self, source, filename):
+        tree = source if isinstance(source, ast.AST) else ast.parse(source)
         try:
-            self.codegen.visit(ast.parse(source))
+            self.codegen.visit(tree)
         except PickoraError as e:
+            if not isinstance(source, str):
+                raise
             # fetch the source from current node (full line)
             lineno = self.codegen.current_node.lineno
             colno = self.codegen.current_node.col_offset
@@ -364,13 +551,40 @@ class Compiler(pickle._Pickler):
             error_message += f"{e.__class__.__name__}: {e}"
             raise PickoraError(error_message) from e
 
+    def compile(self, source, filename="<string>"):
+        if not filename:
+            filename = "<string>"
+
+        self.reset()
+
+        if self.optimizer is None:
+            if self.proto >= 2:
+                self.write(pickle.PROTO + pack("<B", self.proto))
+            if self.proto >= 4:
+                self.framer.start_framing()
+        self.generate(source, filename)
+
         self.write(pickle.STOP)
+        if self.optimizer is not None:
+            return self.optimizer.getvalue()
+
         self.framer.end_framing()
+        return self.opcodes.getvalue()
 
-        opcode = self.opcodes.getvalue()
-        if self.optimize:
-            return pickletools.optimize(opcode)
-        return opcode
+    # compile the source code into a relocatable unit for the linker
+    def compile_unit(self, source, filename="<string>"):
+        if not filename:
+            filename = "<string>"
+
+        self.reset()
+
+        if self.optimizer is None:
+            self.record()
+        self.codegen.externs = {}
+        self.generate(source, filename)
+
+        return Unit.from_optimizer(self.optimizer, filename,
+                                   externs=list(self.codegen.externs))
 
     def save(self, obj):
         if isinstance(obj, ast.AST):
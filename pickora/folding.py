@@ -0,0 +1,309 @@
+import copy
+import importlib
+import queue
+import re
+import string
+import threading
+
+from .helper import op_to_method
+
+
+# folded results larger than this (in bytes, roughly) are left to the runtime
+MAX_SIZE = 4096
+# seconds a single function may run at compile time
+TIMEOUT = 0.1
+
+NOT_CONSTANT = object()
+
+PURE_FUNCTIONS = {
+    *(("operator", name) for name in op_to_method.values()),
+    *(("builtins", name) for name in (
+        "abs", "ascii", "bin", "bool", "chr", "divmod", "float", "hex", "int",
+        "len", "max", "min", "oct", "ord", "pow", "repr", "round", "sorted",
+        "str", "sum", "tuple",
+    )),
+    *(("builtins", f"str.{name}") for name in (
+        "capitalize", "encode", "endswith", "join", "lower",
+        "lstrip", "replace", "rstrip", "split", "startswith", "strip",
+        "swapcase", "title", "upper",
+    )),
+    *(("builtins", f"bytes.{name}") for name in (
+        "decode", "endswith", "fromhex", "hex", "join", "lower", "lstrip",
+        "replace", "rstrip", "split", "startswith", "strip", "upper",
+    )),
+    *(("base64", name) for name in (
+        "b16decode", "b16encode", "b32decode", "b32encode", "b64decode",
+        "b64encode", "standard_b64decode", "standard_b64encode",
+        "urlsafe_b64decode", "urlsafe_b64encode",
+    )),
+    *(("binascii", name) for name in ("crc32", "hexlify", "unhexlify")),
+    *(("json", name) for name in ("dumps", "loads")),
+    *(("math", name) for name in ("ceil", "e", "fabs", "floor", "inf", "pi", "sqrt", "tau")),
+    *(("string", name) for name in (
+        "ascii_letters", "ascii_lowercase", "ascii_uppercase", "digits",
+        "hexdigits", "octdigits", "printable", "punctuation", "whitespace",
+    )),
+    *(("urllib.parse", name) for name in (
+        "quote", "quote_from_bytes", "quote_plus", "unquote",
+        "unquote_plus", "unquote_to_bytes", "urlencode",
+    )),
+    *(("zlib", name) for name in ("adler32", "crc32")),
+}
+
+# cheap enough (once check() has passed) to run in the compiler's thread
+INLINE_FUNCTIONS = {
+    key for key in PURE_FUNCTIONS if key[0] in ("operator", "builtins", "math")
+}
+
+# printf-style conversion specifiers, up to their width and precision
+printf_spec = re.compile(r"%(?:\([^)]*\))?[-#0 +]*(\*|\d*)(?:\.(\*|\d*))?")
+
+
+def literal_size(value, limit, immutable=False, known=None):
+    """Size (in bytes, roughly) of a value the compiler can save without
+    find_class, or None when it isn't one or it is larger than `limit`.
+
+    Walks the value without recursion and gives up once over the limit, so
+    deep or shared nested tuples can't blow up the compiler. `known` maps the
+    id of already measured literals to `(value, size)`, which aren't walked
+    again.
+    """
+    size, values = 0, [value]
+    while values:
+        value = values.pop()
+        measured = known.get(id(value)) if known else None
+        if measured is not None and measured[0] is value:
+            size += measured[1]
+        elif type(value) in (str, bytes):
+            size += len(value)
+        elif type(value) in (int, bool):
+            size += value.bit_length() // 8 + 1
+        elif type(value) in (type(None), float):
+            size += 8
+        elif type(value) == tuple or (not immutable and type(value) in (list, set)):
+            size += 1
+            values.extend(value)
+        elif type(value) == dict and not immutable:
+            size += 1
+            for key, item in value.items():
+                values += (key, item)
+        else:
+            return None
+        if size > limit:
+            return None
+    return size
+
+
+def is_stable(value):
+    # whether hashing the value is the same in every process, so that a set
+    # of such values is always iterated in the same order
+    if type(value) == tuple:
+        return all(map(is_stable, value))
+    return type(value) in (int, bool) or (type(value) == float and value == value)
+
+
+def printf_padding(fmt):
+    # total width and precision asked by a % format, None for `*`
+    total = 0
+    for width, precision in printf_spec.findall(fmt):
+        if "*" in (width, precision):
+            return None
+        total += int(width or 0) + int(precision or 0)
+    return total
+
+
+def format_padding(fmt):
+    # total width and precision asked by a str.format format, None for nested fields
+    total = 0
+    try:
+        fields = list(string.Formatter().parse(fmt))
+    except ValueError:
+        return None
+    for _, _, spec, _ in fields:
+        if spec and "{" in spec:
+            return None
+        # every number of a spec is a width or a precision, at most
+        total += sum(map(int, re.findall(r"\d+", spec or "")))
+    return total
+
+
+class Worker:
+    # a thread running the slower functions one call at a time, which exits
+    # once it has been idle for a while
+    idle_timeout = 1.0
+
+    def __init__(self):
+        self.requests = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.alive = True
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="pickora-folding")
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                request = self.requests.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    if self.requests.empty():
+                        self.alive = False
+                        return
+                continue
+            if request is None:
+                return
+            func, args, result, done = request
+            try:
+                result.append(func(*args))
+            except Exception:
+                pass
+            done.set()
+
+    def submit(self, func, args):
+        # returns (result, done), or None when the worker has exited
+        result, done = [], threading.Event()
+        with self.lock:
+            if not self.alive:
+                return None
+            self.requests.put((func, args, result, done))
+        return result, done
+
+    def stop(self):
+        # exits once its current call, if any, is over
+        with self.lock:
+            self.alive = False
+            self.requests.put(None)
+
+
+class PureFunctions:
+    """Registry of the pure and deterministic functions (and constants) the
+    compiler may evaluate at compile time, keyed by `(module, name)`.
+
+    Methods are registered under their type, e.g. `("builtins", "str.upper")`.
+    Functions in `inline` run in the compiler's thread, the others in a
+    worker thread which is abandoned when it runs out of time. A registry can
+    be shared between threads, but compilers running in parallel had better
+    use their own `copy()`, so that they don't wait for each other's calls.
+    """
+
+    def __init__(self, functions=PURE_FUNCTIONS, max_size=MAX_SIZE, timeout=TIMEOUT,
+                 inline=INLINE_FUNCTIONS):
+        self.functions = set(functions)
+        self.inline = set(inline)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.resolved = {}
+        self.worker = None
+        self.lock = threading.Lock()  # guards the worker
+
+    def __getstate__(self):
+        # the worker and the resolved functions stay in this process
+        state = self.__dict__.copy()
+        state.update(resolved={}, worker=None)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def __contains__(self, key):
+        return key in self.functions
+
+    def register(self, module, name):
+        self.functions.add((module, name))
+
+    def unregister(self, module, name):
+        self.functions.discard((module, name))
+
+    def lookup(self, key):
+        if key not in self.functions:
+            return NOT_CONSTANT
+        if key not in self.resolved:
+            module, name = key
+            try:
+                obj = importlib.import_module(module)
+                for attr in name.split("."):
+                    obj = getattr(obj, attr)
+            except (ImportError, AttributeError):
+                obj = NOT_CONSTANT
+            self.resolved[key] = obj
+        return self.resolved[key]
+
+    def value(self, key):
+        obj = self.lookup(key)
+        if literal_size(obj, self.max_size) is not None:
+            return obj
+        return NOT_CONSTANT
+
+    def check(self, key, args, known=None):
+        # refuse what would blow up before the result can be measured
+        limit = self.max_size
+        if literal_size(args, limit, known=known) is None:
+            return False
+
+        _, name = key
+        if all(type(arg) == int for arg in args):
+            if key in (("operator", "pow"), ("builtins", "pow")) and len(args) == 2:
+                base, exp = args
+                return exp < 0 or base.bit_length() * exp <= limit * 8
+            if key == ("operator", "lshift"):
+                return args[1] <= limit * 8
+        if key == ("builtins", "round") and len(args) == 2:
+            return type(args[1]) != int or abs(args[1]) <= limit
+        if key == ("operator", "mul") and len(args) == 2:
+            for seq, times in (args, args[::-1]):
+                if type(seq) in (str, bytes, tuple, list) and type(times) == int:
+                    size = literal_size(seq, limit, known=known)
+                    return size is not None and size * times <= limit
+        if key == ("operator", "mod") and type(args[0]) in (str, bytes):
+            fmt = args[0] if type(args[0]) == str else args[0].decode("latin1")
+            size = printf_padding(fmt)
+            return size is not None and size <= limit
+        if name in ("str.format", "str.format_map") and args and type(args[0]) == str:
+            size = format_padding(args[0])
+            return size is not None and size <= limit
+        if name in ("str.replace", "bytes.replace") and len(args) >= 3:
+            seq, old, new = args[:3]
+            if type(old) != type(seq) or type(new) != type(seq):
+                return True  # raises TypeError
+            count = len(seq) // max(len(old), 1) + 1
+            return len(seq) + count * len(new) <= limit
+        return True
+
+    def call(self, key, func, args):
+        if self.timeout is None or key in self.inline:
+            try:
+                return func(*args)
+            except Exception:
+                return NOT_CONSTANT
+
+        with self.lock:
+            request = self.worker.submit(func, args) if self.worker else None
+            if request is None:
+                self.worker = Worker()
+                request = self.worker.submit(func, args)
+            worker = self.worker
+
+        result, done = request
+        if not done.wait(self.timeout):
+            # a function running out of time is abandoned, not interrupted
+            with self.lock:
+                worker.stop()
+                if self.worker is worker:
+                    self.worker = None
+            return NOT_CONSTANT
+        return result[0] if result else NOT_CONSTANT
+
+    def evaluate(self, key, args, known=None):
+        func = self.lookup(key)
+        if not callable(func) or not self.check(key, args, known):
+            return NOT_CONSTANT
+
+        value = self.call(key, func, args)
+        if value is NOT_CONSTANT or literal_size(value, self.max_size, known=known) is None:
+            return NOT_CONSTANT
+        return value
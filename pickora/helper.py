@@ -1,5 +1,6 @@
 import builtins
 import ast
+import struct
 from functools import wraps
 import types
 from operator import attrgetter
@@ -25,6 +26,48 @@ def is_builtins(name):
     return name in builtins.__dir__()
 
 
+def number_value(node):
+    # int / float literals, including the negative ones
+    if type(node) == ast.UnaryOp and type(node.op) == ast.USub:
+        value = number_value(node.operand)
+        return None if value is None else -value
+    if type(node) == ast.Constant and type(node.value) in (int, float):
+        return node.value
+    return None
+
+
+# struct formats for ints, smallest first
+int_typecodes = [
+    ('b', -2**7, 2**7 - 1), ('B', 0, 2**8 - 1),
+    ('h', -2**15, 2**15 - 1), ('H', 0, 2**16 - 1),
+    ('i', -2**31, 2**31 - 1), ('I', 0, 2**32 - 1),
+    ('q', -2**63, 2**63 - 1), ('Q', 0, 2**64 - 1),
+]
+
+
+def pack_numbers(values):
+    """Pack homogeneous ints or floats with `struct`, little-endian and with
+    standard sizes.
+
+    Returns `(format, bytes)`, or None when the values can't be packed
+    without changing them.
+    """
+    types = set(map(type, values))
+    if types == {float}:
+        code = 'd'
+    elif types == {int}:
+        low, high = min(values), max(values)
+        code = next((code for code, min_, max_ in int_typecodes
+                     if min_ <= low and high <= max_), None)
+        if code is None:
+            return None
+    else:
+        return None
+
+    format = f"<{len(values)}{code}"
+    return format, struct.pack(format, *values)
+
+
 def extended(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
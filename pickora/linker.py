@@ -0,0 +1,170 @@
+import marshal
+import pickle
+
+from .helper import PickoraError, PickoraNameError
+from .optimizer import Optimizer, RAW, LARGE, PUT, GET, POP, DUP, GLOBAL
+
+
+MAGIC = b"PKORA\x00U\x01"
+
+
+def is_temp(key):
+    return isinstance(key, str) and key.startswith("temp:")
+
+
+# the arguments of every kind of operation
+op_args = {
+    RAW: (bytes,),
+    LARGE: (bytes, bytes),
+    GLOBAL: (str, str),
+    PUT: ("key",),
+    GET: ("key",),
+    POP: (),
+    DUP: (),
+}
+
+
+def is_key(key):
+    # names, or the (module, name) of a global
+    if type(key) == tuple:
+        return len(key) == 2 and all(type(part) == str for part in key)
+    return type(key) == str
+
+
+def check_unit(unit):
+    # returns what is wrong with a loaded unit, if anything
+    if type(unit) != dict:
+        return "not a dict"
+    for key, type_ in (("protocol", int), ("filename", str), ("exports", list),
+                       ("externs", list), ("ops", list)):
+        if type(unit.get(key)) != type_:
+            return f"missing or invalid '{key}'"
+    if not 0 <= unit["protocol"] <= pickle.HIGHEST_PROTOCOL:
+        return f"unsupported protocol {unit['protocol']}"
+    if not all(type(name) == str for name in unit["exports"] + unit["externs"]):
+        return "invalid names"
+
+    for i, op in enumerate(unit["ops"]):
+        if type(op) != tuple or not op or type(op[0]) != int or op[0] not in op_args or \
+                len(op) != len(op_args[op[0]]) + 1:
+            return f"invalid operation #{i}"
+        for arg, type_ in zip(op[1:], op_args[op[0]]):
+            if not (is_key(arg) if type_ == "key" else type(arg) == type_):
+                return f"invalid operation #{i}"
+    return None
+
+
+class Unit:
+    """A separately compiled piece of code, waiting to be linked.
+
+    The opcodes are kept as recorded by the optimizer, so the memo is still
+    addressed by its keys: names (exported to the following units), temporary
+    names (private to this unit) and `(module, name)` pairs for the globals
+    imported with `find_class` (shared by every unit).
+    """
+
+    def __init__(self, protocol, ops, exports=(), externs=(), filename="<string>"):
+        self.proto = protocol
+        self.ops = ops
+        self.exports = list(exports)
+        self.externs = list(externs)
+        self.filename = filename
+
+    @classmethod
+    def from_optimizer(cls, optimizer, filename="<string>", externs=()):
+        # PUT and GET don't need their bookkeeping once relocated
+        ops = [op[:2] if op[0] in (PUT, GET) else op for op in optimizer.ops]
+        exports = {key: None for key in optimizer.puts
+                   if isinstance(key, str) and not is_temp(key)}
+        return cls(optimizer.proto, ops, exports, externs, filename)
+
+    def dumps(self):
+        return MAGIC + marshal.dumps({
+            "protocol": self.proto,
+            "filename": self.filename,
+            "exports": self.exports,
+            "externs": self.externs,
+            "ops": self.ops,
+        })
+
+    def dump(self, file):
+        file.write(self.dumps())
+
+    @classmethod
+    def loads(cls, data):
+        if not data.startswith(MAGIC):
+            raise PickoraError("Not a pickora unit")
+        try:
+            unit = marshal.loads(data[len(MAGIC):])
+        except (EOFError, ValueError, TypeError) as e:
+            raise PickoraError(f"Corrupted pickora unit: {e}") from e
+        error = check_unit(unit)
+        if error is not None:
+            raise PickoraError(f"Corrupted pickora unit: {error}")
+        return cls(unit["protocol"], unit["ops"], unit["exports"],
+                   unit["externs"], unit["filename"])
+
+    @classmethod
+    def load(cls, file):
+        return cls.loads(file.read())
+
+    def relocate(self, optimizer, index):
+        def key_of(key):
+            # temporary names from different units must not collide
+            return (key, index) if is_temp(key) else key
+
+        skip = None
+        for op in self.ops:
+            kind = op[0]
+            if kind == RAW:
+                optimizer.write(op[1])
+            elif kind == LARGE:
+                optimizer.write_large_bytes(op[1], op[2])
+            elif kind == GLOBAL:
+                key = (op[1], op[2])
+                if key in optimizer.last_put:
+                    # already imported by a previous unit
+                    optimizer.get(key)
+                    skip = key
+                else:
+                    optimizer.write_global(op[1], op[2])
+            elif kind == PUT:
+                if op[1] == skip:
+                    skip = None
+                else:
+                    optimizer.put(key_of(op[1]))
+            elif kind == GET:
+                key = key_of(op[1])
+                if key not in optimizer.last_put:
+                    raise PickoraNameError(
+                        f"Name '{op[1]}' is not defined (in '{self.filename}')"
+                    )
+                optimizer.get(key)
+            elif kind == POP:
+                optimizer.pop()
+            elif kind == DUP:
+                optimizer.dup()
+
+
+def link(units):
+    """Link the units in order into one pickle.
+
+    The memo is renumbered, globals imported by several units are only
+    imported once, and the result is optimized and framed like `-O` does.
+    """
+    units = list(units)
+    if not units:
+        raise PickoraError("Nothing to link")
+
+    proto = units[0].proto
+    for unit in units:
+        if unit.proto != proto:
+            raise PickoraError(
+                f"Unit '{unit.filename}' uses protocol {unit.proto} but '{units[0].filename}' uses protocol {proto}"
+            )
+
+    optimizer = Optimizer(proto)
+    for index, unit in enumerate(units):
+        unit.relocate(optimizer, index)
+    optimizer.write(pickle.STOP)
+    return optimizer.getvalue()
@@ -0,0 +1,199 @@
+import io
+import pickle
+from struct import pack
+
+
+# kinds of the recorded operations
+RAW, LARGE, PUT, GET, POP, DUP, GLOBAL = range(7)
+
+
+def op_put(idx, bin=True):
+    if bin:
+        if idx < 256:
+            return pickle.BINPUT + pack("<B", idx)
+        else:
+            return pickle.LONG_BINPUT + pack("<I", idx)
+    else:
+        return pickle.PUT + repr(idx).encode("ascii") + b'\n'
+
+
+def op_get(idx, bin=True):
+    if bin:
+        if idx < 256:
+            return pickle.BINGET + pack("<B", idx)
+        else:
+            return pickle.LONG_BINGET + pack("<I", idx)
+    else:
+        return pickle.GET + repr(idx).encode("ascii") + b'\n'
+
+
+def op_unicode(value, proto):
+    encoded = value.encode("utf-8", "surrogatepass")
+    if len(encoded) <= 0xff and proto >= 4:
+        return pickle.SHORT_BINUNICODE + pack("<B", len(encoded)) + encoded
+    return pickle.BINUNICODE + pack("<I", len(encoded)) + encoded
+
+
+def op_global(module, name, proto):
+    if proto >= 4:
+        return op_unicode(module, proto) + op_unicode(name, proto) + \
+            pickle.STACK_GLOBAL
+    encoding = "utf-8" if proto >= 3 else "ascii"
+    return pickle.GLOBAL + bytes(module, encoding) + b'\n' + \
+        bytes(name, encoding) + b'\n'
+
+
+class Optimizer:
+    """Peephole optimizer which works while the opcodes are being emitted.
+
+    Memo operations are recorded with their symbolic keys (the names used by
+    `NodeVisitor.memo`) instead of memo indices, everything else is kept as
+    raw bytes. Redundant pairs are folded away as soon as they are written:
+
+    - `GET x; POP` and `DUP; POP` are dropped
+    - `PUT x; POP; GET x` becomes `PUT x`
+    - `PUT x; GET x` becomes `PUT x; DUP`
+
+    `getvalue()` then walks the recorded operations once, drops every `PUT`
+    which is never read, renumbers the memo (picking the cheapest of a slot
+    per `PUT` or per key, with the 1-byte `BINGET` indices given to the most
+    used slots when it pays off) and frames the output.
+    """
+
+    def __init__(self, protocol=pickle.DEFAULT_PROTOCOL):
+        self.proto = protocol
+        self.bin = protocol >= 1
+        self.ops = []
+        self.puts = []      # memo key of every recorded PUT
+        self.uses = []      # number of GETs reading every recorded PUT
+        self.last_put = {}  # memo key -> its latest PUT
+
+    def write(self, data):
+        self.ops.append((RAW, data))
+
+    def write_large_bytes(self, header, payload):
+        self.ops.append((LARGE, header, payload))
+
+    def write_global(self, module, name):
+        self.ops.append((GLOBAL, module, name))
+
+    def put(self, key):
+        put = len(self.puts)
+        self.puts.append(key)
+        self.uses.append(0)
+        self.last_put[key] = put
+        self.ops.append((PUT, key, put))
+
+    def get(self, key):
+        ops = self.ops
+        # keys which were never put are left for the linker
+        put = self.last_put.get(key)
+        if ops and ops[-1][0] == PUT and ops[-1][2] == put:
+            # the value is still on top of the stack
+            ops.append((DUP,))
+        elif len(ops) > 1 and ops[-1][0] == POP and \
+                ops[-2][0] == PUT and ops[-2][2] == put:
+            # the value was just popped, keep it instead
+            ops.pop()
+        else:
+            if put is not None:
+                self.uses[put] += 1
+            ops.append((GET, key, put))
+
+    def dup(self):
+        self.ops.append((DUP,))
+
+    def pop(self):
+        ops = self.ops
+        if ops and ops[-1][0] == GET:
+            put = ops.pop()[2]
+            if put is not None:
+                self.uses[put] -= 1
+        elif ops and ops[-1][0] == DUP:
+            ops.pop()
+        else:
+            ops.append((POP,))
+
+    def memoize(self, idx, assigned):
+        if idx in assigned:
+            return op_put(idx, self.bin)
+        if self.proto >= 4 and idx == len(assigned):
+            assigned.add(idx)
+            return pickle.MEMOIZE
+        assigned.add(idx)
+        return op_put(idx, self.bin)
+
+    def cost(self, memo):
+        # size of all the alive memo operations with this numbering
+        size, assigned = 0, set()
+        for put, uses in enumerate(self.uses):
+            if uses:
+                idx = memo[put]
+                size += len(self.memoize(idx, assigned))
+                size += len(op_get(idx, self.bin)) * uses
+        return size
+
+    def numberings(self, live, slot_of):
+        # number the slots by order of their first alive PUT, then try to
+        # give the 1-byte indices to the hottest slots, which might cost more
+        # than it saves since it breaks MEMOIZE
+        counts = {}
+        for put in live:
+            slot = slot_of(put)
+            counts[slot] = counts.get(slot, 0) + self.uses[put] + 1
+
+        slots = list(counts)
+        yield slots
+        if len(slots) > 256:
+            hot = set(sorted(slots, key=counts.__getitem__, reverse=True)[:256])
+            yield [slot for slot in slots if slot in hot] + \
+                [slot for slot in slots if slot not in hot]
+
+    def renumber(self):
+        # the memo index of every alive PUT, either one slot per PUT (like
+        # pickletools.optimize, every PUT can be a MEMOIZE) or one slot per
+        # memo key (fewer slots, so more of them fit in 1-byte indices)
+        live = [put for put, uses in enumerate(self.uses) if uses]
+        candidates = []
+        for slot_of in (lambda put: put, self.puts.__getitem__):
+            for slots in self.numberings(live, slot_of):
+                idx = {slot: idx for idx, slot in enumerate(slots)}
+                candidates.append({put: idx[slot_of(put)] for put in live})
+        # the first cheapest one, which is the numbering of pickletools on a tie
+        return min(candidates, key=self.cost)
+
+    def getvalue(self):
+        memo = self.renumber()
+        assigned = set()
+
+        output = io.BytesIO()
+        framer = pickle._Framer(output.write)
+        if self.proto >= 2:
+            output.write(pickle.PROTO + pack("<B", self.proto))
+        if self.proto >= 4:
+            framer.start_framing()
+
+        write = framer.write
+        for op in self.ops:
+            kind = op[0]
+            if kind == RAW:
+                write(op[1])
+                framer.commit_frame()
+            elif kind == PUT:
+                if not self.uses[op[2]]:
+                    continue
+                write(self.memoize(memo[op[2]], assigned))
+            elif kind == GET:
+                write(op_get(memo[op[2]], self.bin))
+            elif kind == POP:
+                write(pickle.POP)
+            elif kind == DUP:
+                write(pickle.DUP)
+            elif kind == GLOBAL:
+                write(op_global(op[1], op[2], self.proto))
+                framer.commit_frame()
+            elif kind == LARGE:
+                framer.write_large_bytes(op[1], op[2])
+
+        framer.end_framing()
+        return output.getvalue()
@@ -0,0 +1,80 @@
+import asyncio
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .compiler import Compiler
+
+
+# the compiler of a worker process
+_compiler = None
+
+
+def _new_compiler(options):
+    # compilers running in parallel don't share the folding worker
+    if options.get("pure_functions") is not None:
+        options = dict(options, pure_functions=options["pure_functions"].copy())
+    return Compiler(**options)
+
+
+def _init_worker(options):
+    global _compiler
+    _compiler = _new_compiler(options)
+
+
+def _compile_in_worker(source, filename):
+    return _compiler.compile(source, filename)
+
+
+class CompilerPool:
+    """A bounded pool of warm compilers, reused between compilations.
+
+    `acompile()` offloads the compilation to worker threads (or processes,
+    to compile in parallel) so an asyncio event loop is never blocked.
+    Options are passed to every `Compiler`, each of them gets its own copy
+    of `pure_functions`.
+    """
+
+    def __init__(self, size=4, processes=False, **options):
+        self.size = size
+        self.processes = processes
+        if processes:
+            self.compilers = None
+            self.executor = ProcessPoolExecutor(size, initializer=_init_worker,
+                                                initargs=(options,))
+        else:
+            self.compilers = queue.LifoQueue()
+            for _ in range(size):
+                self.compilers.put(_new_compiler(options))
+            self.executor = ThreadPoolExecutor(size, thread_name_prefix="pickora")
+
+    def compile(self, source, filename="<string>"):
+        if self.processes:
+            return self.executor.submit(_compile_in_worker, source, filename).result()
+
+        # blocks until a compiler is free
+        compiler = self.compilers.get()
+        try:
+            return compiler.compile(source, filename)
+        finally:
+            self.compilers.put(compiler)
+
+    async def acompile(self, source, filename="<string>"):
+        loop = asyncio.get_running_loop()
+        if self.processes:
+            return await loop.run_in_executor(self.executor, _compile_in_worker, source, filename)
+        return await loop.run_in_executor(self.executor, self.compile, source, filename)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,90 @@
+import ast
+import pickle
+from struct import pack
+
+from .compiler import Compiler, VECTORIZE_THRESHOLD
+from .helper import PickoraError
+
+
+class Session:
+    """Compile a program a few statements at a time.
+
+    The memo and the other state of the compiler are kept between the calls
+    of `feed()`, which only returns the opcodes of the new statements. From
+    protocol 4, every chunk is framed on its own.
+    """
+
+    def __init__(self, protocol=pickle.DEFAULT_PROTOCOL, extended=False,
+                 vectorize=VECTORIZE_THRESHOLD, pure_functions=None):
+        self.compiler = Compiler(protocol=protocol, extended=extended,
+                                 vectorize=vectorize, pure_functions=pure_functions)
+        self.finished = False
+        self.offset = 0
+
+        if self.compiler.proto >= 2:
+            self.compiler.write(pickle.PROTO + pack("<B", self.compiler.proto))
+
+    def start_framing(self):
+        # the opcodes of a chunk are all known before it is returned
+        if self.compiler.proto >= 4:
+            self.compiler.framer.start_framing()
+
+    def __len__(self):
+        return self.compiler.opcodes.tell()
+
+    def read(self):
+        opcodes = self.compiler.opcodes
+        opcodes.seek(self.offset)
+        code = opcodes.read()
+        self.offset = opcodes.tell()
+        return code
+
+    def feed(self, source, filename="<string>"):
+        """Compile source code, a statement or an expression, and return the
+        new opcodes (including the protocol header on the first call).
+
+        Nothing is kept from a statement which fails to compile.
+        """
+        if self.finished:
+            raise PickoraError("The session is already finished")
+
+        if isinstance(source, ast.expr):
+            source = ast.Expr(value=source)
+        if isinstance(source, ast.stmt):
+            source = ast.Module(body=[source], type_ignores=[])
+
+        codegen, framer = self.compiler.codegen, self.compiler.framer
+        memo_size, offset = len(codegen.memo), len(self)
+        try:
+            self.start_framing()
+            self.compiler.generate(source, filename or "<string>")
+            framer.end_framing()
+        except PickoraError:
+            # drop the half compiled statement
+            framer.current_frame = None
+            self.compiler.opcodes.seek(offset)
+            self.compiler.opcodes.truncate()
+            while len(codegen.memo) > memo_size:
+                codegen.memo.popitem()
+            codegen.symbols.clear()
+            codegen.constants.clear()
+            codegen.sizes.clear()
+            raise
+        finally:
+            # the nodes won't be visited again
+            codegen.folded.clear()
+
+        return self.read()
+
+    def finish(self):
+        """Terminate the pickle and return the remaining opcodes."""
+        if self.finished:
+            raise PickoraError("The session is already finished")
+        self.finished = True
+        self.start_framing()
+        self.compiler.write(pickle.STOP)
+        self.compiler.framer.end_framing()
+        return self.read()
+
+    def getvalue(self):
+        return self.compiler.opcodes.getvalue()
@@ -0,0 +1,69 @@
+import pickle
+import threading
+import time
+import unittest
+
+from pickora import Compiler
+from pickora.folding import PureFunctions
+
+
+def compile(source, extended=True, **options):
+    return Compiler(extended=extended, **options).compile(source)
+
+
+class FoldingTest(unittest.TestCase):
+    def assertFolded(self, source, value):
+        code = compile(source)
+        self.assertNotIn(b"R", code.rstrip(b"."))  # no REDUCE left
+        self.assertEqual(pickle.loads(code), value)
+
+    def test_fold(self):
+        self.assertFolded('"-" * 4', "----")
+        self.assertFolded("from base64 import b64encode\nb64encode(b'hi')", b"aGk=")
+        self.assertFolded("x = 2\ny = x ** 10\ny + 1", 1025)
+
+    def test_limits(self):
+        for source, call in (('"-" * 10**6', b"mul"), ("2 ** 10**6", b"pow"),
+                             ('"%9999999d" % 1', b"mod"), ("round(1.5, 10**9)", b"round"),
+                             ("('ab' * 1000).replace('a', 'a' * 2000)", b"replace")):
+            with self.subTest(source=source):
+                self.assertIn(call, compile(source))
+
+        functions = PureFunctions(max_size=8)
+        self.assertIn(b"operator", compile('"-" * 16', pure_functions=functions))
+
+    def test_not_extended(self):
+        # names aren't tracked, and nothing runs at compile time
+        threads = threading.active_count()
+        code = compile("from base64 import b64encode\nx = b64encode(b'hi')\nx", extended=False)
+        self.assertIn(b"b64encode", code)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_nested_constants(self):
+        # deep and shared tuples stay cheap to track
+        chain = "b = 0\n" + "\n".join(f"b = (a, {i})" if i % 2 else f"a = (b, {i})"
+                                      for i in range(2000))
+        shared = "a = b = 1\n" + "a = (b, b)\nb = (a, a)\n" * 100
+        for source in (chain, shared):
+            for extended in (False, True):
+                start = time.perf_counter()
+                pickle.loads(compile(source + "\na", extended))
+                self.assertLess(time.perf_counter() - start, 2)
+
+    def test_patched_modules(self):
+        # attributes read after the program assigns to a module aren't folded
+        for patch in ("string.digits = 'patched'", "setattr(string, 'digits', 'patched')",
+                      "string.__dict__['digits'] = 'patched'"):
+            with self.subTest(patch=patch):
+                code = compile(f"import string\ndigits = string.digits\n{patch}\n"
+                               "(digits, string.digits)")
+                self.assertEqual(code.count(b"digits"), 2)
+
+    def test_sets(self):
+        # the order of str items depends on the hash seed
+        self.assertIn(b"join", compile("','.join({'alpha', 'beta', 'gamma'})"))
+        self.assertFolded("sum({1, 2, 3})", 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
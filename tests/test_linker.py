@@ -0,0 +1,115 @@
+import io
+import marshal
+import pickle
+import pickletools
+import unittest
+
+from pickora import Compiler, Unit, link
+from pickora.helper import PickoraError, PickoraNameError
+from pickora.linker import MAGIC
+
+
+PRELUDE = """\
+from operator import add, mul
+table = {'a': 1, 'b': 2}
+twice = [add, mul]
+"""
+
+PAYLOAD = """\
+from operator import add
+result = add(table['a'], table['b'])
+(result, twice, mul(result, 7))
+"""
+
+
+def compile_unit(source, protocol=pickle.DEFAULT_PROTOCOL, filename="<string>"):
+    return Compiler(protocol=protocol, extended=True).compile_unit(source, filename)
+
+
+def globals_of(code):
+    # the names imported by find_class, from the strings before STACK_GLOBAL
+    # or from the GLOBAL opcodes
+    names, strings = [], []
+    for opcode, arg, _ in pickletools.genops(code):
+        if opcode.name == "GLOBAL":
+            names.append(tuple(arg.split(" ")))
+        elif opcode.name == "STACK_GLOBAL":
+            names.append(tuple(strings[-2:]))
+        elif isinstance(arg, str):
+            strings.append(arg)
+    return names
+
+
+class LinkerTest(unittest.TestCase):
+    def test_dumps_loads(self):
+        unit = compile_unit(PAYLOAD, filename="payload.py")
+        for data in (unit.dumps(), io.BytesIO(unit.dumps()).read()):
+            loaded = Unit.loads(data)
+            self.assertEqual(loaded.proto, unit.proto)
+            self.assertEqual(loaded.ops, unit.ops)
+            self.assertEqual(loaded.exports, unit.exports)
+            self.assertEqual(loaded.externs, ["table", "twice", "mul"])
+            self.assertEqual(loaded.filename, "payload.py")
+
+        file = io.BytesIO()
+        unit.dump(file)
+        file.seek(0)
+        self.assertEqual(Unit.load(file).ops, unit.ops)
+
+    def test_link(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            with self.subTest(protocol=protocol):
+                units = [Unit.loads(compile_unit(source, protocol).dumps())
+                         for source in (PRELUDE, PAYLOAD)]
+                code = link(units)
+                whole = Compiler(protocol=protocol, extended=True,
+                                 optimize=True).compile(PRELUDE + PAYLOAD)
+                self.assertEqual(pickle.loads(code), pickle.loads(whole))
+                self.assertEqual(len(code), len(whole))
+
+                # operator.add is imported by both units, but only once
+                names = globals_of(code)
+                self.assertEqual(len(names), len(set(names)))
+                self.assertIn(("operator", "add"), names)
+
+    def test_undefined_extern(self):
+        with self.assertRaisesRegex(PickoraNameError, "'table' is not defined.*payload.py"):
+            link([compile_unit(PAYLOAD, filename="payload.py")])
+        with self.assertRaisesRegex(PickoraNameError, "'table'"):
+            # the names of a unit are only visible to the following ones
+            link([compile_unit(PAYLOAD), compile_unit(PRELUDE)])
+
+    def test_temporaries(self):
+        # temporary names of different units don't collide
+        source = "x = (1 == 1 == 1)\n"
+        units = [compile_unit(source), compile_unit(source + "x")]
+        self.assertIs(pickle.loads(link(units)), True)
+
+    def test_protocol_mismatch(self):
+        with self.assertRaisesRegex(PickoraError, "protocol"):
+            link([compile_unit(PRELUDE, 3), compile_unit(PAYLOAD, 4)])
+        with self.assertRaisesRegex(PickoraError, "Nothing to link"):
+            link([])
+
+    def test_corrupt_units(self):
+        unit = compile_unit(PAYLOAD)
+        data = unit.dumps()
+
+        def dumps(**changes):
+            fields = marshal.loads(data[len(MAGIC):])
+            fields.update(changes)
+            return MAGIC + marshal.dumps(fields)
+
+        for corrupt in (b"", b"not a unit", data[:len(MAGIC) + 10],
+                        MAGIC + marshal.dumps([1, 2]),
+                        dumps(protocol="4"), dumps(protocol=99),
+                        dumps(exports=[1]), dumps(ops=[(99, b"")]),
+                        dumps(ops=[(0,)]), dumps(ops=[(0, "not bytes")]),
+                        dumps(ops=[(2, ("a", 1))])):
+            with self.subTest(data=corrupt[:40]):
+                with self.assertRaises(PickoraError):
+                    Unit.loads(corrupt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import pickle
+import pickletools
+import random
+import unittest
+
+from pickora import Compiler
+
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "samples")
+
+
+def program(rng, lines, names):
+    # reassigned names, reads, temporaries (or, ==) and named expressions
+    source, defined = [], []
+    for i in range(lines):
+        choice = rng.random()
+        if choice < 0.3 or not defined:
+            value = rng.choice(defined) if defined and rng.random() < 0.5 else \
+                rng.choice([str(rng.randrange(-1000, 1000)), f"'s{i}'", "[1, 2]", "(1,)"])
+            name = f"v{rng.randrange(names)}"
+            source.append(f"{name} = {value}")
+        elif choice < 0.5:
+            a, b = rng.choice(defined), rng.choice(defined)
+            name = f"t{i}"
+            source.append(f"{name} = ({a}, {b}, {a})")
+        elif choice < 0.6:
+            a, b = rng.choice(defined), rng.choice(defined)
+            name = f"c{i}"
+            source.append(f"{name} = ({a} == {b} == {a})")
+        elif choice < 0.7:
+            a, b = rng.choice(defined), rng.choice(defined)
+            name = f"o{i}"
+            source.append(f"{name} = ({a} or {b})")
+        elif choice < 0.8:
+            source.append(rng.choice(defined))
+            continue
+        else:
+            a = rng.choice(defined)
+            name = f"n{i}"
+            source.append(f"{name} = [{a}, (w{i} := {a}), w{i}]")
+            defined.append(f"w{i}")
+        defined.append(name)
+    source.append(f"({', '.join(sorted(set(defined)))},)")
+    return "\n".join(source)
+
+
+class OptimizerTest(unittest.TestCase):
+    def assertOptimized(self, source, load=True):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            with self.subTest(protocol=protocol):
+                plain = Compiler(protocol=protocol, extended=True).compile(source)
+                optimized = Compiler(protocol=protocol, extended=True, optimize=True).compile(source)
+                self.assertLessEqual(len(optimized), len(pickletools.optimize(plain)))
+                if load:
+                    self.assertEqual(repr(pickle.loads(optimized)), repr(pickle.loads(plain)))
+                else:
+                    list(pickletools.genops(optimized))
+
+    def test_random_programs(self):
+        rng = random.Random(1337)
+        for i in range(30):
+            source = program(rng, rng.randrange(5, 600), rng.choice([5, 50, 400]))
+            with self.subTest(program=i):
+                self.assertOptimized(source)
+
+    def test_reassigned(self):
+        # every alive PUT of a reassigned name can be a MEMOIZE
+        self.assertOptimized("x = 'a'\ny = 'b'\n[x, y, x, y]\nx = 'c'\n[y, x, y, x]\n"
+                             "x = 'd'\n[y, x, y, x]")
+
+    def test_many_slots(self):
+        # more than 256 alive memo slots, some of them much more used
+        source = "\n".join(f"v{i} = {i}" for i in range(600))
+        source += "\n" + "\n".join(f"(v{i % 7}, v{i})" for i in range(600))
+        self.assertOptimized(source)
+
+    def test_samples(self):
+        # loading the samples runs commands, only check they are well-formed
+        for name in ("general.py", "picklection.py", "test_calculation.py"):
+            with open(os.path.join(SAMPLES, name)) as f:
+                source = f.read()
+            with self.subTest(sample=name):
+                self.assertOptimized(source, load=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
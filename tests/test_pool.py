@@ -0,0 +1,100 @@
+import asyncio
+import pickle
+import threading
+import time
+import unittest
+
+from pickora import Compiler, CompilerPool, PureFunctions
+from pickora.folding import PURE_FUNCTIONS
+from pickora.helper import PickoraError
+
+
+SOURCES = [f"x = ('{i}', {i})\ny = [x, x]\n(x, y, len(y))" for i in range(40)]
+
+
+def slow(value):
+    time.sleep(0.05)
+    return value
+
+
+def slow_functions(timeout):
+    # a function which runs in the worker thread, and may time out
+    functions = PureFunctions(PURE_FUNCTIONS | {("test_pool", "slow")}, timeout=timeout)
+    functions.resolved[("test_pool", "slow")] = slow
+    return functions
+
+
+class CompilerPoolTest(unittest.TestCase):
+    def expected(self, sources, **options):
+        return [Compiler(**options).compile(source) for source in sources]
+
+    def test_reuse_after_errors(self):
+        with CompilerPool(size=2, extended=True) as pool:
+            for _ in range(3):
+                with self.assertRaises(PickoraError):
+                    pool.compile("x = (1, 2)\nundefined_name")
+                with self.assertRaises(SyntaxError):
+                    pool.compile("x = (")
+            self.assertEqual([pool.compile(source) for source in SOURCES],
+                             self.expected(SOURCES, extended=True))
+
+    def test_acompile(self):
+        async def compile_all(pool):
+            bad = [pool.acompile("undefined_name") for _ in range(5)]
+            results = await asyncio.gather(*(pool.acompile(source) for source in SOURCES),
+                                           *bad, return_exceptions=True)
+            return results[:len(SOURCES)], results[len(SOURCES):]
+
+        for processes in (False, True):
+            with self.subTest(processes=processes):
+                with CompilerPool(size=4, processes=processes, extended=True) as pool:
+                    codes, errors = asyncio.run(compile_all(pool))
+                    self.assertEqual(codes, self.expected(SOURCES, extended=True))
+                    self.assertTrue(all(isinstance(e, PickoraError) for e in errors))
+
+    def test_shared_pure_functions(self):
+        # every compiler gets its own copy of the registry
+        functions = slow_functions(timeout=0.01)
+        with CompilerPool(size=4, extended=True, pure_functions=functions) as pool:
+            compilers = list(pool.compilers.queue)
+            self.assertEqual(len({id(c.codegen.pure_functions) for c in compilers}), 4)
+            self.assertTrue(all(c.codegen.pure_functions is not functions for c in compilers))
+
+    def test_concurrent_timeouts(self):
+        # one registry shared by compilers in several threads
+        functions = slow_functions(timeout=0.01)
+        source = "from test_pool import slow\nslow(1)"
+        errors = []
+
+        def run():
+            try:
+                compiler = Compiler(extended=True, pure_functions=functions)
+                for _ in range(5):
+                    self.assertEqual(pickle.loads(compiler.compile("(1, 'a')")), (1, "a"))
+                    compiler.compile(source)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_pickle_pure_functions(self):
+        functions = PureFunctions(timeout=1)
+        functions.evaluate(("base64", "b64encode"), [b"hi"])  # starts the worker
+        self.assertIsNotNone(functions.worker)
+        copy = pickle.loads(pickle.dumps(functions))
+        self.assertIsNone(copy.worker)
+        self.assertEqual(copy.functions, functions.functions)
+        self.assertEqual(copy.evaluate(("base64", "b64encode"), [b"hi"]), b"aGk=")
+
+        with CompilerPool(size=2, processes=True, extended=True, pure_functions=functions) as pool:
+            code = pool.compile("from base64 import b64encode\nb64encode(b'hi')")
+            self.assertEqual(pickle.loads(code), b"aGk=")
+
+
+if __name__ == "__main__":
+    unittest.main()
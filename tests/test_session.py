@@ -0,0 +1,85 @@
+import pickle
+import pickletools
+import struct
+import unittest
+
+from pickora import Compiler, Session
+from pickora.helper import PickoraError
+
+
+STATEMENTS = [
+    "from operator import add, mul",
+    "x = add(1, 2)",
+    "y = [x, 'a' * 3]",
+    "data = b'\\x00' * 100000",
+    "z = mul(x, 2)",
+    "(x, y, z, len(data))",
+]
+
+
+def opcodes(code):
+    return [opcode.name for opcode, _, _ in pickletools.genops(code)]
+
+
+class SessionTest(unittest.TestCase):
+    def test_feed(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            with self.subTest(protocol=protocol):
+                session = Session(protocol=protocol, extended=True)
+                code = b"".join(session.feed(statement) for statement in STATEMENTS)
+                code += session.finish()
+                self.assertEqual(code, session.getvalue())
+                self.assertEqual(len(session), len(code))
+
+                whole = Compiler(protocol=protocol, extended=True).compile("\n".join(STATEMENTS))
+                self.assertEqual(pickle.loads(code), pickle.loads(whole))
+
+    def test_frames(self):
+        session = Session(protocol=4, extended=True)
+        for statement in STATEMENTS:
+            chunk = session.feed(statement)
+            # every chunk is one whole frame (after the header), except
+            # the ones too small to be worth it
+            if chunk.startswith(pickle.PROTO):
+                chunk = chunk[2:]
+            if len(chunk) >= 4:
+                self.assertEqual(chunk[:1], pickle.FRAME)
+                self.assertEqual(struct.unpack("<Q", chunk[1:9])[0], len(chunk) - 9)
+        self.assertEqual(session.finish(), pickle.STOP)
+        self.assertIn("FRAME", opcodes(session.getvalue()))
+
+        session = Session(protocol=3)
+        session.feed("x = 1")
+        self.assertNotIn("FRAME", opcodes(session.getvalue() + session.finish()))
+
+    def test_rollback(self):
+        for protocol in (2, 4):
+            with self.subTest(protocol=protocol):
+                session = Session(protocol=protocol, extended=True)
+                session.feed("x = 1")
+                size = len(session)
+                for statement in ("y = 2\nz = undefined", "x = undefined", "y = (1, 2"):
+                    with self.assertRaises((PickoraError, SyntaxError)):
+                        session.feed(statement)
+                    self.assertEqual(len(session), size)
+
+                # the names of the failed statements are forgotten
+                with self.assertRaises(PickoraError):
+                    session.feed("y")
+                session.feed("z = (x, 3)")
+                code = session.getvalue() + session.finish()
+                self.assertEqual(pickle.loads(code), (1, 3))
+
+    def test_finish(self):
+        session = Session()
+        self.assertEqual(session.feed("1"), b"\x80\x04K\x01")
+        self.assertEqual(session.finish(), pickle.STOP)
+        self.assertEqual(pickle.loads(session.getvalue()), 1)
+        with self.assertRaisesRegex(PickoraError, "already finished"):
+            session.feed("2")
+        with self.assertRaisesRegex(PickoraError, "already finished"):
+            session.finish()
+
+
+if __name__ == "__main__":
+    unittest.main()
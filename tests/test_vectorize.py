@@ -0,0 +1,99 @@
+import math
+import pickle
+import unittest
+
+from pickora import Compiler
+from pickora.compiler import VECTORIZE_THRESHOLD
+
+
+def compile(source, protocol=pickle.DEFAULT_PROTOCOL, optimize=False):
+    return Compiler(protocol=protocol, optimize=optimize, extended=True).compile(source)
+
+
+def literal(values, factory):
+    # float('inf') has no literal, 1e999 overflows to it
+    items = ", ".join("1e999" if value == math.inf else
+                      "-1e999" if value == -math.inf else repr(value)
+                      for value in values)
+    if factory is tuple:
+        return f"({items},)"
+    if factory is set:
+        return f"{{{items}}}"
+    return f"[{items}]"
+
+
+def is_packed(code):
+    return b"unpack" in code
+
+
+class VectorizeTest(unittest.TestCase):
+    def assertSameValues(self, loaded, expected):
+        self.assertIs(type(loaded), type(expected))
+        self.assertEqual(len(loaded), len(expected))
+        if isinstance(expected, set):
+            loaded, expected = sorted(loaded), sorted(expected)
+        for a, b in zip(loaded, expected):
+            self.assertIs(type(a), type(b))
+            if isinstance(b, float):
+                # keeps -0.0 apart from 0.0
+                self.assertEqual(math.copysign(1, a), math.copysign(1, b))
+            self.assertEqual(a, b)
+
+    def assertRoundTrip(self, values, packed=True):
+        for factory in (list, tuple, set):
+            expected = factory(values)
+            source = literal(values, factory)
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                for optimize in (False, True):
+                    with self.subTest(factory=factory.__name__, protocol=protocol, optimize=optimize):
+                        code = compile(source, protocol, optimize)
+                        # bytes are only cheap from protocol 3
+                        self.assertEqual(is_packed(code), packed and protocol >= 3)
+                        self.assertSameValues(pickle.loads(code), expected)
+
+    def test_int_typecode_edges(self):
+        for low, high in ((-2**7, 2**7 - 1), (0, 2**8 - 1),
+                          (-2**15, 2**15 - 1), (0, 2**16 - 1),
+                          (-2**31, 2**31 - 1), (0, 2**32 - 1),
+                          (-2**63, 2**63 - 1), (0, 2**64 - 1)):
+            with self.subTest(low=low, high=high):
+                # mostly large values, where packing is smaller
+                values = [low] + [high - i for i in range(VECTORIZE_THRESHOLD)]
+                self.assertRoundTrip(values)
+
+    def test_floats(self):
+        values = [-0.0, 0.0, 5e-324, -5e-324, 2.2250738585072014e-308,
+                  math.inf, -math.inf, 1.7976931348623157e308, 0.1]
+        # distinct, so that sets are as large as lists
+        self.assertRoundTrip(values + [i + 0.5 for i in range(VECTORIZE_THRESHOLD)])
+
+    def test_not_packed(self):
+        self.assertRoundTrip([True, False] * VECTORIZE_THRESHOLD, packed=False)
+        self.assertRoundTrip([1, 2.5] * VECTORIZE_THRESHOLD, packed=False)
+        self.assertRoundTrip([2**64] + list(range(VECTORIZE_THRESHOLD)), packed=False)
+        self.assertRoundTrip([-2**63 - 1] + list(range(VECTORIZE_THRESHOLD)), packed=False)
+        # one large int would make every item 8 bytes
+        self.assertRoundTrip([2**40] + list(range(VECTORIZE_THRESHOLD * 4)), packed=False)
+
+    def test_smaller(self):
+        for values in ([2**40] + list(range(1000)), [2**31 - i for i in range(1000)],
+                       [i + 0.5 for i in range(1000)], [i % 100 for i in range(1000)]):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                with self.subTest(values=values[:2], protocol=protocol):
+                    packed = compile(literal(values, list), protocol)
+                    plain = Compiler(protocol=protocol, extended=True,
+                                     vectorize=0).compile(literal(values, list))
+                    self.assertLessEqual(len(packed), len(plain))
+
+    def test_threshold(self):
+        self.assertRoundTrip(list(range(VECTORIZE_THRESHOLD - 1)), packed=False)
+        self.assertRoundTrip(list(range(VECTORIZE_THRESHOLD)), packed=True)
+
+    def test_disabled(self):
+        source = literal(range(VECTORIZE_THRESHOLD), list)
+        self.assertFalse(is_packed(Compiler(vectorize=0, extended=True).compile(source)))
+        self.assertFalse(is_packed(Compiler(extended=False).compile(source)))
+
+
+if __name__ == "__main__":
+    unittest.main()